@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+
+from zangetsu_logger.cloud_handlers import _MAX_RETAINED_BUFFERS, CloudStorageHandler
+
+
+class FailingHandler(CloudStorageHandler):
+    """アップロードが常に失敗するハンドラ"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.attempts = 0
+
+    def _upload_logs(self, body):
+        self.attempts += 1
+        raise ConnectionError("backend is down")
+
+
+class StalledHandler(CloudStorageHandler):
+    """unblock が設定されるまでアップロードが終わらないハンドラ"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.unblock = threading.Event()
+        self.bodies = []
+
+    def _upload_logs(self, body):
+        self.unblock.wait()
+        self.bodies.append(body)
+
+
+def _make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.handlers.clear()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+def test_failed_uploads_do_not_grow_buffer_without_bound():
+    handler = FailingHandler(capacity=10, flush_interval=0, max_buffer_bytes=1024)
+    logger = _make_logger("test.cloud.failing", handler)
+
+    for i in range(3000):
+        logger.info("record %d %s", i, "x" * 40)
+
+    # 実行中のアップロードの失敗を待つ
+    handler._get_executor().shutdown(wait=True)
+
+    assert handler.attempts > 0
+    assert handler._buffer_bytes <= 1024 * _MAX_RETAINED_BUFFERS
+    assert handler._buffer_bytes == sum(len(line) + 1 for line in handler.buffer)
+    # 残っているのは新しいログ
+    assert handler.buffer[-1].endswith(b"record 2999 " + b"x" * 40)
+
+
+def test_emit_does_not_block_while_uploads_are_stalled():
+    handler = StalledHandler(capacity=1, flush_interval=0)
+    logger = _make_logger("test.cloud.stalled", handler)
+
+    started = time.monotonic()
+    for i in range(50):
+        logger.info("record %d", i)
+    assert time.monotonic() - started < 1.0
+
+    handler.unblock.set()
+    handler.close()
+    # アップロードは並行して行われるため、順序は問わずに全件が送られたことを確認する
+    lines = b"".join(handler.bodies).splitlines()
+    assert sorted(lines) == sorted(f"record {i}".encode() for i in range(50))
@@ -0,0 +1,52 @@
+import logging
+
+from zangetsu_logger.config import initialize
+
+CONFIG = """
+version: 1
+disable_existing_loggers: false
+handlers:
+  console:
+    class: logging.StreamHandler
+    level: WARNING
+    stream: ext://sys.stderr
+root:
+  level: DEBUG
+  handlers: [console]
+"""
+
+
+class ListHandler(logging.Handler):
+    def __init__(self, level=logging.NOTSET):
+        super().__init__(level)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_initialize_does_not_raise_logger_level_to_handler_levels(tmp_path):
+    config_path = tmp_path / "logging.yaml"
+    config_path.write_text(CONFIG, encoding="utf-8")
+
+    logger = initialize(config_path=str(config_path), app_name="myapp")
+
+    # 子ロガーが独自に持つ DEBUG ハンドラ
+    db_handler = ListHandler(logging.DEBUG)
+    db_logger = logging.getLogger("myapp.db")
+    db_logger.addHandler(db_handler)
+
+    # initialize() の後から追加したハンドラ
+    late_handler = ListHandler(logging.INFO)
+    logger.addHandler(late_handler)
+
+    try:
+        assert logger.isEnabledFor(logging.DEBUG)
+        db_logger.debug("query")
+        logger.info("started")
+    finally:
+        db_logger.removeHandler(db_handler)
+        logger.removeHandler(late_handler)
+
+    assert db_handler.messages == ["query"]
+    assert late_handler.messages == ["started"]
@@ -0,0 +1,286 @@
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from zangetsu_logger.handlers import EnvVarFileHandler, _compile_format
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+requires_dev_full = pytest.mark.skipif(
+    not os.path.exists("/dev/full"), reason="/dev/full が必要"
+)
+
+
+def _record(msg, level=logging.INFO):
+    return logging.makeLogRecord({"msg": msg, "levelno": level})
+
+
+@pytest.fixture
+def quiet_errors(monkeypatch):
+    """handleError による stderr への出力を抑える"""
+    monkeypatch.setattr(logging, "raiseExceptions", False)
+
+
+@requires_dev_full
+def test_write_errors_do_not_stop_the_writer_thread(quiet_errors):
+    handler = EnvVarFileHandler("/dev/full", flush_interval=0)
+    try:
+        handler.handle(_record("first"))
+        flusher = threading.Thread(target=handler.flush)
+        flusher.start()
+        flusher.join(5)
+        assert not flusher.is_alive()
+
+        # 書き込みスレッドは生きていて、後続のフラッシュ要求も処理される
+        assert handler._writer_thread.is_alive()
+        handler.handle(_record("second"))
+        flusher = threading.Thread(target=handler.flush)
+        flusher.start()
+        flusher.join(5)
+        assert not flusher.is_alive()
+    finally:
+        handler.close()
+
+
+@requires_dev_full
+def test_interpreter_exits_after_write_errors():
+    script = (
+        "import logging\n"
+        "logging.raiseExceptions = False\n"
+        "from zangetsu_logger.handlers import EnvVarFileHandler\n"
+        "logger = logging.getLogger('full')\n"
+        "logger.addHandler(EnvVarFileHandler('/dev/full'))\n"
+        "logger.warning('lost')\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, timeout=30, capture_output=True
+    )
+    assert result.returncode == 0
+
+
+def test_flush_writes_queued_records(tmp_path):
+    path = tmp_path / "app.log"
+    handler = EnvVarFileHandler(str(path), flush_interval=0)
+    try:
+        for i in range(3):
+            handler.handle(_record(f"line {i}"))
+        handler.flush()
+        assert path.read_text(encoding="utf-8") == "line 0\nline 1\nline 2\n"
+    finally:
+        handler.close()
+
+
+def test_records_queued_after_close_request_are_written(tmp_path):
+    path = tmp_path / "app.log"
+    handler = EnvVarFileHandler(str(path), flush_interval=0)
+    handler.handle(_record("first"))
+
+    # 書き込みスレッドの停止後、close() が完了する前に emit と flush を割り込ませる
+    thread = handler._writer_thread
+    join = thread.join
+    flushers = []
+
+    def join_and_race(timeout=None):
+        join(timeout)
+        handler._queue.put_nowait(_record("late"))
+        flusher = threading.Thread(target=handler.flush)
+        flusher.start()
+        flushers.append(flusher)
+
+    thread.join = join_and_race
+    handler.close()
+
+    flushers[0].join(5)
+    assert not flushers[0].is_alive()
+    assert path.read_text(encoding="utf-8") == "first\nlate\n"
+
+
+def test_message_arguments_are_captured_at_log_time(tmp_path):
+    path = tmp_path / "app.log"
+    handler = EnvVarFileHandler(str(path), flush_interval=0)
+    logger = logging.getLogger("test.handlers.args")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    state = {"step": 0}
+    try:
+        for step in range(3):
+            state["step"] = step
+            logger.info("state=%s", state)
+            state["step"] = 99
+        handler.flush()
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+    assert path.read_text(encoding="utf-8").splitlines() == [
+        "state={'step': 0}",
+        "state={'step': 1}",
+        "state={'step': 2}",
+    ]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork が必要")
+def test_forked_child_flushes_periodically(tmp_path):
+    path = tmp_path / "app.log"
+    handler = EnvVarFileHandler(str(path), flush_interval=1)
+    try:
+        # fork 時に他のスレッドが保持しているロックを再現する
+        with handler._writer_lock:
+            pid = os.fork()
+        if pid == 0:
+            try:
+                handler.handle(_record("child"))
+                time.sleep(2.5)
+            finally:
+                # close() せずに終了し、定期フラッシュで書き込まれたことを確認する
+                os._exit(0)
+
+        deadline = time.monotonic() + 10
+        while os.waitpid(pid, os.WNOHANG) == (0, 0):
+            if time.monotonic() > deadline:
+                os.kill(pid, 9)
+                os.waitpid(pid, 0)
+                pytest.fail("子プロセスが終了しない")
+            time.sleep(0.05)
+        assert path.read_text(encoding="utf-8") == "child\n"
+    finally:
+        handler.close()
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.msg, record.args))
+
+
+def test_later_handlers_see_the_original_record(tmp_path):
+    handler = EnvVarFileHandler(str(tmp_path / "app.log"), flush_interval=0)
+    later = ListHandler()
+    logger = logging.getLogger("test.handlers.shared")
+    logger.addHandler(handler)
+    logger.addHandler(later)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    event = {"event": "login", "user": "alice"}
+    try:
+        logger.info("user %s logged in", "alice")
+        logger.info(event)
+        handler.flush()
+    finally:
+        logger.removeHandler(handler)
+        logger.removeHandler(later)
+        handler.close()
+
+    assert later.records == [("user %s logged in", ("alice",)), (event, ())]
+    assert later.records[1][0] is event
+
+
+class BlockingFormatter(logging.Formatter):
+    """unblock が設定されるまでフォーマットが終わらないフォーマッタ"""
+
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+
+    def format(self, record):
+        self.unblock.wait()
+        return super().format(record)
+
+
+def test_records_are_dropped_when_the_queue_is_full(tmp_path):
+    path = tmp_path / "app.log"
+    formatter = BlockingFormatter()
+    handler = EnvVarFileHandler(str(path), flush_interval=0, max_queue_size=5)
+    handler.setFormatter(formatter)
+    errors = []
+    handler.handleError = lambda record: errors.append(record.getMessage())
+
+    try:
+        # 書き込みスレッドを最初のレコードのフォーマット中で止める
+        handler.handle(_record("line 0"))
+        deadline = time.monotonic() + 5
+        while handler._queue.qsize():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        for i in range(1, 20):
+            handler.handle(_record(f"line {i}"))
+        assert handler._queue.qsize() == 5
+        # 破棄が続く間の報告は1回だけ
+        assert errors == ["line 6"]
+    finally:
+        formatter.unblock.set()
+        handler.close()
+
+    assert path.read_text(encoding="utf-8").splitlines() == [
+        f"line {i}" for i in range(6)
+    ]
+
+
+def _format_record():
+    record = logging.LogRecord(
+        "app.mod", logging.INFO, "/src/app/mod.py", 42, "hello %s", ("world",), None
+    )
+    record.created = 1700000000.25
+    record.msecs = 250.0
+    return record
+
+
+@pytest.mark.parametrize(
+    "fmt",
+    [
+        "%(levelname)-8s %(name)s:%(lineno)d %(message)s",
+        "100%% %(message)r",
+        "%(process)5d|%(msecs)03d %(message)s",
+        "%(message)s",
+    ],
+)
+def test_compiled_format_matches_formatter(tmp_path, fmt):
+    formatter = logging.Formatter(fmt)
+    handler = EnvVarFileHandler(str(tmp_path / "app.log"), delay=True)
+    handler.setFormatter(formatter)
+    try:
+        assert _compile_format(formatter) is not None
+        assert handler.format(_format_record()) == formatter.format(_format_record())
+    finally:
+        handler.close()
+
+
+def test_compiled_format_follows_formatter_changes(tmp_path):
+    formatter = logging.Formatter("%(asctime)s %(message)s", datefmt="%Y-%m-%d")
+    handler = EnvVarFileHandler(str(tmp_path / "app.log"), delay=True)
+    handler.setFormatter(formatter)
+    try:
+        assert handler.format(_format_record()) == formatter.format(_format_record())
+
+        # 解析後の datefmt や書式の変更も Formatter.format と同じく反映される
+        formatter.datefmt = "%H:%M"
+        assert handler.format(_format_record()) == formatter.format(_format_record())
+
+        formatter._style._fmt = "[%(levelname)s] %(message)s"
+        assert handler.format(_format_record()) == "[INFO] hello world"
+    finally:
+        handler.close()
+
+
+def test_unsupported_formats_fall_back_to_formatter():
+    # "*" による幅指定、他のスタイル、サブクラスは解析しない
+    assert _compile_format(logging.Formatter("%(message)*s")) is None
+    assert _compile_format(logging.Formatter("{message}", style="{")) is None
+
+    class Upper(logging.Formatter):
+        def format(self, record):
+            return super().format(record).upper()
+
+    assert _compile_format(Upper("%(message)s")) is None
@@ -0,0 +1,51 @@
+import logging
+import threading
+import time
+
+from zangetsu_logger.cloud_handlers import CloudStorageHandler
+from zangetsu_logger.handlers import EnvVarFileHandler
+
+
+class BlockingFormatter(logging.Formatter):
+    """unblock が設定されるまでフォーマットが終わらないフォーマッタ"""
+
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+
+    def format(self, record):
+        self.unblock.wait()
+        return super().format(record)
+
+
+class RecordingHandler(CloudStorageHandler):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bodies = []
+
+    def _upload_logs(self, body):
+        self.bodies.append(body)
+
+
+def test_stuck_file_handler_does_not_stop_periodic_cloud_uploads(tmp_path):
+    # 書き込みスレッドが止まったファイルハンドラを先に登録する
+    formatter = BlockingFormatter()
+    file_handler = EnvVarFileHandler(str(tmp_path / "app.log"), flush_interval=1)
+    file_handler.setFormatter(formatter)
+    cloud_handler = RecordingHandler(capacity=100, flush_interval=1)
+
+    record = logging.makeLogRecord({"msg": "hello", "levelno": logging.INFO})
+    try:
+        file_handler.handle(record)
+        cloud_handler.handle(record)
+
+        deadline = time.monotonic() + 5
+        while not cloud_handler.bodies and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert cloud_handler.bodies == [b"hello\n"]
+    finally:
+        formatter.unblock.set()
+        file_handler.close()
+        cloud_handler.close()
+
+    assert (tmp_path / "app.log").read_text(encoding="utf-8") == "hello\n"
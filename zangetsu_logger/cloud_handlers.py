@@ -1,20 +1,41 @@
 import io
+import itertools
 import logging
 import os
 import threading
 import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import MemoryHandler
 from typing import List, Optional
 
+from zangetsu_logger.scheduler import flush_scheduler
+
+# 同時に実行中（待機中を含む）にできるアップロードの最大数
+_MAX_PENDING_UPLOADS = 4
+
+# アップロードの失敗・滞留時に保持するログの上限（max_buffer_bytes の倍数）
+_MAX_RETAINED_BUFFERS = 4
+
+# このサイズ以上のS3アップロードはマルチパートで送信する
+_S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+# stderr へのエラー出力の最小間隔（秒）
+_ERROR_REPORT_INTERVAL = 1.0
+
 
 class CloudStorageHandler(MemoryHandler):
     """
     クラウドストレージにログをバッチアップロードするための基底クラス
 
-    ログレコードをメモリにバッファし、一定量または一定時間経過後に
+    ログレコードは受け取った時点でフォーマットしてバイト列としてメモリにバッファし、
+    一定量（件数またはバイト数）または一定時間経過後に
     クラウドストレージにアップロードします。
     """
 
+    # 最後に stderr へエラーを出力した時刻（全ハンドラで共有）
+    _last_error_time = float("-inf")
+
     def __init__(
         self,
         capacity: int = 100,
@@ -22,65 +43,200 @@ class CloudStorageHandler(MemoryHandler):
         flushOnClose: bool = True,
         flush_interval: int = 60,  # 60秒ごとに強制フラッシュ
         formatter: Optional[logging.Formatter] = None,
+        max_buffer_bytes: int = 4 * 1024 * 1024,  # 4MBを超えたらフラッシュ
     ):
         # カスタムtargetを使わずに初期化（後でオーバーライド）
         super().__init__(capacity, flushLevel, None, flushOnClose)
 
         self.formatter = formatter
         self.flush_interval = flush_interval
+        self.max_buffer_bytes = max_buffer_bytes
         self._buffer_lock = threading.RLock()
-        self._last_flush_time = time.time()
+        self._buffer_bytes = 0
+        self._last_flush_time = time.monotonic()
+
+        # アップロードはロギングスレッドを塞がないようバックグラウンドで行う
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._upload_slots = threading.BoundedSemaphore(_MAX_PENDING_UPLOADS)
+
+        # オブジェクト名の衝突回避用（ホスト間はトークン、プロセス間はPID、
+        # 同一プロセス内は連番で区別し、フラッシュごとの乱数生成を避ける）
+        self._name_token = os.urandom(4).hex()
+        self._name_seq = itertools.count()
 
-        # 定期的なフラッシュを行うタイマースレッドを開始
+        # 定期的なフラッシュを共有スケジューラに登録
         if flush_interval > 0:
-            self._start_timer()
+            flush_scheduler.register(self)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """
+        ログレコードをフォーマットしてバッファに追加
+
+        LogRecord自体は保持せず、UTF-8エンコード済みのバイト列だけをバッファする
+        """
+        try:
+            if self.formatter:
+                line = self.formatter.format(record).encode("utf-8")
+            else:
+                line = record.getMessage().encode("utf-8")
+        except Exception:
+            self.handleError(record)
+            return
 
-    def _start_timer(self) -> None:
-        """定期的なフラッシュを行うタイマーを開始"""
+        with self._buffer_lock:
+            self.buffer.append(line)
+            self._buffer_bytes += len(line) + 1  # 改行分を含める
+            self._trim_buffer()
 
-        def _flush_timer():
-            while True:
-                time.sleep(self.flush_interval)
-                if time.time() - self._last_flush_time >= self.flush_interval:
-                    self.flush()
+        if self.shouldFlush(record):
+            self.flush()
 
-        timer_thread = threading.Thread(target=_flush_timer, daemon=True)
-        timer_thread.start()
+    def shouldFlush(self, record: logging.LogRecord) -> bool:
+        """件数・バイト数・ログレベルのいずれかが閾値に達したらフラッシュする"""
+        return (
+            len(self.buffer) >= self.capacity
+            or self._buffer_bytes >= self.max_buffer_bytes
+            or record.levelno >= self.flushLevel
+        )
 
     def flush(self) -> None:
         """バッファ内のログをクラウドストレージにアップロード"""
+        self._flush(block=False)
+
+    def _periodic_flush(self) -> None:
+        """定期フラッシュ（アップロードの空きを待たず、完了も待たない）"""
+        self._flush(block=False)
+
+    def _flush(self, block: bool) -> None:
+        """
+        バッファ内のログをアップロード用スレッドプールに渡す
+
+        未完了のアップロードが上限に達している場合、block=False ならログをバッファに
+        残したまま戻る（ロギングスレッドや定期フラッシュを待たせないため）
+        """
+        if not self._upload_slots.acquire(blocking=block):
+            return
+
         with self._buffer_lock:
-            if self.buffer:
-                try:
-                    self._upload_logs(self.buffer)
-                    self.buffer = []
-                    self._last_flush_time = time.time()
-                except Exception as e:
-                    # エラーが発生した場合はエラーログを出力
-                    import sys
-
-                    sys.stderr.write(
-                        f"Error uploading logs to cloud storage: {str(e)}\n"
-                    )
-                    import traceback
+            if not self.buffer:
+                self._upload_slots.release()
+                return
+            records = self.buffer
+            self.buffer = []
+            self._buffer_bytes = 0
+            self._last_flush_time = time.monotonic()
+
+        try:
+            self._get_executor().submit(self._upload_in_background, records)
+        except RuntimeError:
+            # クローズ後やインタプリタ終了処理中は呼び出し元のスレッドでアップロード
+            self._upload_in_background(records)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """アップロード用スレッドプールの遅延初期化"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=2, thread_name_prefix="zangetsu-upload"
+                )
+            return self._executor
 
-                    traceback.print_exc(file=sys.stderr)
+    def _trim_buffer(self) -> None:
+        """
+        保持しているログが上限を超えた場合に古いものから破棄する
 
-    def _upload_logs(self, records: List[logging.LogRecord]) -> None:
+        _buffer_lock を保持した状態で呼び出す。上限からさらにバッファ1つ分を下回るまで
+        まとめて破棄し、ログを追加するたびに先頭の削除を繰り返さないようにする
         """
-        ログレコードをクラウドストレージにアップロード（サブクラスで実装）
+        limit = self.max_buffer_bytes * _MAX_RETAINED_BUFFERS
+        if self._buffer_bytes <= limit:
+            return
+
+        target = limit - self.max_buffer_bytes
+        size = self._buffer_bytes
+        dropped = 0
+        for line in self.buffer:
+            if size <= target:
+                break
+            size -= len(line) + 1
+            dropped += 1
+        del self.buffer[:dropped]
+        self._buffer_bytes = size
+        self._report_error(
+            f"Dropped {dropped} buffered log lines: "
+            "cloud storage upload is failing or backlogged\n"
+        )
+
+    @classmethod
+    def _report_error(cls, message: str) -> None:
+        """
+        エラーを stderr に出力
+
+        sys.stderr のロックとエンコード処理を避けて1回の write で書き込み、
+        障害が続く場合に備えて出力は一定間隔に1回までに抑える
+        """
+        now = time.monotonic()
+        if now - cls._last_error_time < _ERROR_REPORT_INTERVAL:
+            return
+        CloudStorageHandler._last_error_time = now
+        try:
+            os.write(2, message.encode("utf-8", "replace"))
+        except OSError:
+            pass
+
+    def _upload_in_background(self, records: List[bytes]) -> None:
+        """ログをアップロードし、失敗した場合は次回のフラッシュで再送する"""
+        try:
+            # 末尾の改行まで含めて1回の確保で連結する
+            body = b"\n".join(itertools.chain(records, (b"",)))
+            self._upload_logs(body)
+        except Exception as e:
+            # エラーが発生した場合はトレースバックと合わせて出力
+            self._report_error(
+                f"Error uploading logs to cloud storage: {str(e)}\n"
+                f"{traceback.format_exc()}"
+            )
+
+            # 失敗したログはバッファの先頭に戻す（上限を超えた分は古いものから破棄）
+            with self._buffer_lock:
+                self.buffer[:0] = records
+                self._buffer_bytes += sum(len(line) + 1 for line in records)
+                self._trim_buffer()
+        finally:
+            self._upload_slots.release()
+
+    def _object_name(self, prefix: str) -> str:
+        """タイムスタンプベースのオブジェクト名を生成"""
+        timestamp = time.strftime("%Y/%m/%d/%H%M%S", time.gmtime())
+        return (
+            f"{prefix}{timestamp}-{self._name_token}"
+            f"-{os.getpid():x}-{next(self._name_seq):x}.log"
+        )
+
+    def _upload_logs(self, body: bytes) -> None:
+        """
+        ログをクラウドストレージにアップロード（サブクラスで実装）
 
         Parameters:
         -----------
-        records : List[logging.LogRecord]
-            アップロードするログレコードのリスト
+        body : bytes
+            改行区切りで連結したUTF-8エンコード済みのログ
         """
         raise NotImplementedError("Subclasses must implement _upload_logs")
 
     def close(self) -> None:
         """ハンドラをクローズする際の処理"""
+        flush_scheduler.unregister(self)
         if self.flushOnClose:
-            self.flush()
+            # クローズ時は実行中のアップロードが空くのを待ってから送る
+            self._flush(block=True)
+
+        # 実行中のアップロードの完了を待つ
+        with self._executor_lock:
+            executor = self._executor
+        if executor is not None:
+            executor.shutdown(wait=True)
         super().close()
 
 
@@ -103,6 +259,7 @@ class S3Handler(CloudStorageHandler):
         flushOnClose: bool = True,
         flush_interval: int = 60,
         formatter: Optional[logging.Formatter] = None,
+        max_buffer_bytes: int = 4 * 1024 * 1024,
     ):
         """
         Parameters:
@@ -127,8 +284,17 @@ class S3Handler(CloudStorageHandler):
             定期的なフラッシュの間隔（秒）
         formatter : logging.Formatter, optional
             ログのフォーマッタ
+        max_buffer_bytes : int, default=4MB
+            バッファに保持するログの最大バイト数（超えるとフラッシュする）
         """
-        super().__init__(capacity, flushLevel, flushOnClose, flush_interval, formatter)
+        super().__init__(
+            capacity,
+            flushLevel,
+            flushOnClose,
+            flush_interval,
+            formatter,
+            max_buffer_bytes,
+        )
 
         self.bucket_name = bucket_name
         self.key_prefix = key_prefix.rstrip("/") + "/"
@@ -164,42 +330,37 @@ class S3Handler(CloudStorageHandler):
 
         return self._s3_client
 
-    def _upload_logs(self, records: List[logging.LogRecord]) -> None:
-        """ログレコードをS3にアップロード"""
-        if not records:
+    def _upload_logs(self, body: bytes) -> None:
+        """ログをS3にアップロード"""
+        if not body:
             return
 
-        # ログをフォーマットしてバッファに格納
-        log_buffer = io.StringIO()
-        for record in records:
-            if self.formatter:
-                formatted_record = self.formatter.format(record)
-                log_buffer.write(formatted_record)
-                log_buffer.write("\n")
-            else:
-                log_buffer.write(record.getMessage())
-                log_buffer.write("\n")
-
         # タイムスタンプベースのオブジェクトキーを生成
-        timestamp = time.strftime("%Y/%m/%d/%H%M%S", time.gmtime())
-        random_suffix = os.urandom(4).hex()  # 衝突を避けるためのランダムサフィックス
-        key = f"{self.key_prefix}{timestamp}-{random_suffix}.log"
+        key = self._object_name(self.key_prefix)
 
-        # S3にアップロード
+        # S3にアップロード（大きなバッチはマルチパートでストリーム送信）
         try:
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=key,
-                Body=log_buffer.getvalue().encode("utf-8"),
-                ContentType="text/plain",
-                ContentEncoding="utf-8",
-            )
+            if len(body) >= _S3_MULTIPART_THRESHOLD:
+                from boto3.s3.transfer import TransferConfig
+
+                self.s3_client.upload_fileobj(
+                    io.BytesIO(body),
+                    self.bucket_name,
+                    key,
+                    ExtraArgs={"ContentType": "text/plain", "ContentEncoding": "utf-8"},
+                    Config=TransferConfig(multipart_threshold=_S3_MULTIPART_THRESHOLD),
+                )
+            else:
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    Body=body,
+                    ContentType="text/plain",
+                    ContentEncoding="utf-8",
+                )
         except Exception as e:
-            import sys
-
-            sys.stderr.write(
-                f"Failed to upload logs to S3 bucket '{self.bucket_name}': {str(e)}\n"
-            )
+            # 呼び出し元で出力するトレースバックにバケット名を残す
+            e.add_note(f"Failed to upload logs to S3 bucket '{self.bucket_name}'")
             raise
 
 
@@ -221,6 +382,7 @@ class GCSHandler(CloudStorageHandler):
         flushOnClose: bool = True,
         flush_interval: int = 60,
         formatter: Optional[logging.Formatter] = None,
+        max_buffer_bytes: int = 4 * 1024 * 1024,
     ):
         """
         Parameters:
@@ -243,8 +405,17 @@ class GCSHandler(CloudStorageHandler):
             定期的なフラッシュの間隔（秒）
         formatter : logging.Formatter, optional
             ログのフォーマッタ
+        max_buffer_bytes : int, default=4MB
+            バッファに保持するログの最大バイト数（超えるとフラッシュする）
         """
-        super().__init__(capacity, flushLevel, flushOnClose, flush_interval, formatter)
+        super().__init__(
+            capacity,
+            flushLevel,
+            flushOnClose,
+            flush_interval,
+            formatter,
+            max_buffer_bytes,
+        )
 
         self.bucket_name = bucket_name
         self.blob_prefix = blob_prefix.rstrip("/") + "/"
@@ -290,35 +461,19 @@ class GCSHandler(CloudStorageHandler):
             self._bucket = self.storage_client.bucket(self.bucket_name)
         return self._bucket
 
-    def _upload_logs(self, records: List[logging.LogRecord]) -> None:
-        """ログレコードをGCSにアップロード"""
-        if not records:
+    def _upload_logs(self, body: bytes) -> None:
+        """ログをGCSにアップロード"""
+        if not body:
             return
 
-        # ログをフォーマットしてバッファに格納
-        log_buffer = io.StringIO()
-        for record in records:
-            if self.formatter:
-                formatted_record = self.formatter.format(record)
-                log_buffer.write(formatted_record)
-                log_buffer.write("\n")
-            else:
-                log_buffer.write(record.getMessage())
-                log_buffer.write("\n")
-
         # タイムスタンプベースのブロブ名を生成
-        timestamp = time.strftime("%Y/%m/%d/%H%M%S", time.gmtime())
-        random_suffix = os.urandom(4).hex()  # 衝突を避けるためのランダムサフィックス
-        blob_name = f"{self.blob_prefix}{timestamp}-{random_suffix}.log"
+        blob_name = self._object_name(self.blob_prefix)
 
         # GCSにアップロード
         try:
             blob = self.bucket.blob(blob_name)
-            blob.upload_from_string(log_buffer.getvalue(), content_type="text/plain")
+            blob.upload_from_string(body, content_type="text/plain")
         except Exception as e:
-            import sys
-
-            sys.stderr.write(
-                f"Failed to upload logs to GCS bucket '{self.bucket_name}': {str(e)}\n"
-            )
+            # 呼び出し元で出力するトレースバックにバケット名を残す
+            e.add_note(f"Failed to upload logs to GCS bucket '{self.bucket_name}'")
             raise
@@ -1,25 +1,73 @@
-import importlib.resources as pkg_resources
+import copy
+import functools
 import logging
 import logging.config
 import os
+import sys
 from typing import Any, Dict, Optional
 
 import yaml
 
-from zangetsu_logger.formatters import zangetsuJsonFormatter
+from zangetsu_logger.formatters import zangetsuCachingJsonFormatter
 from zangetsu_logger.handlers import EnvVarFileHandler
 
+# libyaml が利用可能であればC実装のローダーを使用（なければ純Python実装）
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_default_config() -> Dict[str, Any]:
+    """パッケージ同梱のデフォルト設定を一度だけ読み込んでキャッシュする"""
+    # importlib.resources は import コストが大きいため使用時に読み込む
+    import importlib.resources as pkg_resources
+
+    config_text = pkg_resources.read_text(__package__, "default_config.yaml")
+    return yaml.load(config_text, Loader=_Loader)
+
 
 def get_default_config() -> Dict[str, Any]:
     """デフォルトのロガー設定を読み込む"""
-    config_text = pkg_resources.read_text(__package__, "default_config.yaml")
-    return yaml.safe_load(config_text)
+    # 呼び出し側で変更されてもキャッシュに影響しないようにコピーを返す
+    return copy.deepcopy(_load_default_config())
+
+
+@functools.lru_cache(maxsize=2)
+def _load_default_config_variant(enable_file_logging: bool) -> Dict[str, Any]:
+    """ファイル出力の有無に応じて加工済みのデフォルト設定をキャッシュする"""
+    config = copy.deepcopy(_load_default_config())
+    if not enable_file_logging:
+        _restrict_to_console(config)
+
+        # どこからも参照されなくなったハンドラは生成しない（不要なファイル作成を防ぐ）
+        used = set(config.get("root", {}).get("handlers", []))
+        for logger_config in config.get("loggers", {}).values():
+            used.update(logger_config.get("handlers", []))
+        config["handlers"] = {
+            name: handler
+            for name, handler in config.get("handlers", {}).items()
+            if name in used
+        }
+    return config
+
+
+def _restrict_to_console(config: Dict[str, Any]) -> None:
+    """ロガーとルートロガーのハンドラをコンソールハンドラのみに絞り込む"""
+    # ロガー定義をループしてファイルハンドラを削除
+    for logger_name, logger_config in config.get("loggers", {}).items():
+        handlers = logger_config.get("handlers", [])
+        # コンソールハンドラのみを保持する
+        logger_config["handlers"] = [h for h in handlers if h == "console"]
+
+    # ルートロガーにも同様の処理
+    if "root" in config:
+        handlers = config["root"].get("handlers", [])
+        config["root"]["handlers"] = [h for h in handlers if h == "console"]
 
 
 def configure_from_yaml(config_path: str) -> Dict[str, Any]:
     """YAMLファイルからロガー設定を読み込む"""
     with open(config_path, "r", encoding="utf-8") as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=_Loader)
 
     logging.config.dictConfig(config)
     return config
@@ -64,6 +112,7 @@ def initialize(
           - 'credentials_file': 認証情報ファイルパス (optional)
         - 'flush_interval': フラッシュ間隔（秒）
         - 'capacity': バッファサイズ
+        - 'max_buffer_bytes': バッファの最大バイト数（超えるとアップロード）
         - 'min_level': 最小ログレベル
 
     Returns:
@@ -81,21 +130,13 @@ def initialize(
 
     if config_path and os.path.exists(config_path):
         config = configure_from_yaml(config_path)
-    else:
-        config = get_default_config()
-
-    # ファイル出力を無効化する場合の処理
-    if not enable_file_logging:
-        # ロガー定義をループしてファイルハンドラを削除
-        for logger_name, logger_config in config.get("loggers", {}).items():
-            handlers = logger_config.get("handlers", [])
-            # コンソールハンドラのみを保持する
-            logger_config["handlers"] = [h for h in handlers if h == "console"]
 
-        # ルートロガーにも同様の処理
-        if "root" in config:
-            handlers = config["root"].get("handlers", [])
-            config["root"]["handlers"] = [h for h in handlers if h == "console"]
+        # ファイル出力を無効化する場合の処理
+        if not enable_file_logging:
+            _restrict_to_console(config)
+    else:
+        # デフォルト設定はファイル出力の有無ごとに加工済みのものをコピーして使う
+        config = copy.deepcopy(_load_default_config_variant(enable_file_logging))
 
     # コンソールハンドラのログレベルを調整
     if "handlers" in config and "console" in config["handlers"]:
@@ -104,21 +145,16 @@ def initialize(
             config["handlers"]["console"]["level"] = level
 
     # 既存のハンドラをクリア（重複を防ぐため）
-    root_logger = logging.getLogger()
-    for handler in root_logger.handlers[:]:
-        root_logger.removeHandler(handler)
+    logging.getLogger().handlers.clear()
 
     # 設定を適用
     logging.config.dictConfig(config)
 
-    # アプリケーション名の決定
+    # アプリケーション名の決定（呼び出し元モジュールのトップレベルパッケージ名）
     if app_name is None:
-        import inspect
-
-        frame = inspect.stack()[1]
-        module = inspect.getmodule(frame[0])
-        if module:
-            app_name = module.__name__.split(".")[0]
+        caller_name = sys._getframe(1).f_globals.get("__name__")
+        if caller_name:
+            app_name = caller_name.split(".")[0]
         else:
             app_name = "zangetsu"
 
@@ -126,54 +162,51 @@ def initialize(
     logger = logging.getLogger(app_name)
 
     # 既存のハンドラがあれば削除（重複を防ぐため）
-    for handler in logger.handlers[:]:
-        logger.removeHandler(handler)
+    logger.handlers.clear()
 
     if log_level:
         level = getattr(logging, log_level.upper(), None)
         if level is not None:
             logger.setLevel(level)
 
-    # ロガーの取得とログレベルの設定
-    logger = logging.getLogger(app_name)
+    # JSONを出力するハンドラ間で共有し、レコードごとのJSON変換を1回にする
+    json_formatter = zangetsuCachingJsonFormatter()
 
     if enable_file_logging:
+        log_dir = os.environ.get("zangetsu_LOG_DIR") or os.getcwd()
+
         # app_logハンドラを追加
-        app_log_path = os.path.join(
-            os.environ.get("zangetsu_LOG_DIR", os.getcwd()), "zangetsu_app.log"
-        )
+        app_log_path = os.path.join(log_dir, "zangetsu_app.log")
         file_handler = EnvVarFileHandler(
             app_log_path, maxBytes=10485760, backupCount=5, encoding="utf8"
         )
         file_handler.setLevel(logging.DEBUG)
-        file_handler.setFormatter(zangetsuJsonFormatter())
+        file_handler.setFormatter(json_formatter)
         logger.addHandler(file_handler)
 
         # error_logハンドラを追加
-        error_log_path = os.path.join(
-            os.environ.get("zangetsu_LOG_DIR", os.getcwd()), "zangetsu_error.log"
-        )
+        error_log_path = os.path.join(log_dir, "zangetsu_error.log")
         error_handler = EnvVarFileHandler(
             error_log_path, maxBytes=10485760, backupCount=5, encoding="utf8"
         )
         error_handler.setLevel(logging.ERROR)
-        error_handler.setFormatter(zangetsuJsonFormatter())
+        error_handler.setFormatter(json_formatter)
         logger.addHandler(error_handler)
 
     # クラウドストレージハンドラの設定
     if cloud_storage:
         storage_type = cloud_storage.get("type")
         if storage_type == "s3":
-            _setup_s3_handler(logger, cloud_storage)
+            _setup_s3_handler(logger, cloud_storage, json_formatter)
         elif storage_type == "gcs":
-            _setup_gcs_handler(logger, cloud_storage)
+            _setup_gcs_handler(logger, cloud_storage, json_formatter)
         else:
             logger.warning(f"Unknown cloud storage type: {storage_type}")
 
     return logger
 
 
-def _setup_s3_handler(logger, cloud_storage):
+def _setup_s3_handler(logger, cloud_storage, formatter):
     """S3ハンドラをセットアップする"""
     from zangetsu_logger.cloud_handlers import S3Handler
 
@@ -194,7 +227,8 @@ def _setup_s3_handler(logger, cloud_storage):
             logging, cloud_storage.get("min_level", "ERROR").upper(), logging.ERROR
         ),
         flush_interval=cloud_storage.get("flush_interval", 60),
-        formatter=zangetsuJsonFormatter(),
+        formatter=formatter,
+        max_buffer_bytes=cloud_storage.get("max_buffer_bytes", 4 * 1024 * 1024),
     )
 
     # 最小ログレベルを設定
@@ -210,7 +244,7 @@ def _setup_s3_handler(logger, cloud_storage):
     )
 
 
-def _setup_gcs_handler(logger, cloud_storage):
+def _setup_gcs_handler(logger, cloud_storage, formatter):
     """Google Cloud Storageハンドラをセットアップする"""
     from zangetsu_logger.cloud_handlers import GCSHandler
 
@@ -230,7 +264,8 @@ def _setup_gcs_handler(logger, cloud_storage):
             logging, cloud_storage.get("min_level", "ERROR").upper(), logging.ERROR
         ),
         flush_interval=cloud_storage.get("flush_interval", 60),
-        formatter=zangetsuJsonFormatter(),
+        formatter=formatter,
+        max_buffer_bytes=cloud_storage.get("max_buffer_bytes", 4 * 1024 * 1024),
     )
 
     # 最小ログレベルを設定
@@ -1,10 +1,45 @@
 import logging
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import socket
 import traceback
 import os
-import pytz  # 必要に応じてpytzをインストール
+
+# 日本時間（JSTは夏時間が無いため固定オフセットで十分）
+JST = timezone(timedelta(hours=9), "JST")
+
+
+def _json_dumps(obj):
+    """標準ライブラリのjsonでJSON文字列に変換"""
+    return json.dumps(obj, default=str, ensure_ascii=False, separators=(",", ":"))
+
+
+try:
+    import orjson
+
+    def _dumps(obj):
+        """orjsonでJSON文字列に変換（高速パス）"""
+        try:
+            return orjson.dumps(obj, default=str).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # サロゲート文字など orjson が扱えない値は標準のjsonで変換する
+            return _json_dumps(obj)
+
+except ImportError:  # orjsonが無い環境では標準のjsonにフォールバック
+    _dumps = _json_dumps
+
+
+# JSON断片のキャッシュに保持する最大件数
+_FRAGMENT_CACHE_SIZE = 4096
+
+
+def _format_timestamp(created):
+    """UNIX時刻をJSTのISO形式文字列に変換（strftimeを使わない高速版）"""
+    t = datetime.fromtimestamp(created, JST)
+    return (
+        f"{t.year:04d}-{t.month:02d}-{t.day:02d}T"
+        f"{t.hour:02d}:{t.minute:02d}:{t.second:02d}.{t.microsecond:06d}Z"
+    )
 
 
 class zangetsuJsonFormatter(logging.Formatter):
@@ -14,57 +49,108 @@ class zangetsuJsonFormatter(logging.Formatter):
         super().__init__(fmt, datefmt, style, validate)
         self.hostname = socket.gethostname()
         # 日本のタイムゾーンを設定
-        self.jst = pytz.timezone("Asia/Tokyo")
+        self.jst = JST
+
+        # 環境変数から追加情報を取得（プロセス中は不変のため初期化時に一度だけ読む）
+        self._env_extras = {}
+        for env_var in ["ENVIRONMENT", "SERVICE_NAME", "VERSION"]:
+            value = os.environ.get(f"zangetsu_{env_var}")
+            if value:
+                self._env_extras[env_var.lower()] = value
+
+        # 不変なフィールドは事前にJSON断片へシリアライズしておく
+        self._hostname_json = ',"hostname":' + _dumps(self.hostname)
+        self._env_json = "".join(
+            f',"{key}":{_dumps(value)}' for key, value in self._env_extras.items()
+        )
+
+        # レベル・ロガー名の組み合わせと呼び出し元ごとのJSON断片のキャッシュ
+        self._headers = {}
+        self._callsites = {}
+
+    def _header_json(self, record):
+        """レベルとロガー名のJSON断片を返す"""
+        key = (record.levelname, record.name)
+        header = self._headers.get(key)
+        if header is None:
+            if len(self._headers) >= _FRAGMENT_CACHE_SIZE:
+                self._headers.clear()
+            header = (
+                f',"level":{_dumps(record.levelname)}'
+                f',"logger":{_dumps(record.name)},"message":'
+            )
+            self._headers[key] = header
+        return header
+
+    def _callsite_json(self, record):
+        """呼び出し元ごとに不変なファイル情報のJSON断片を返す"""
+        key = (record.pathname, record.funcName, record.lineno)
+        info = self._callsites.get(key)
+        if info is None:
+            if len(self._callsites) >= _FRAGMENT_CACHE_SIZE:
+                self._callsites.clear()
+            fields = _dumps(
+                {
+                    "filename": record.filename,
+                    "pathname": record.pathname,
+                    "function": record.funcName,
+                    "line": record.lineno,
+                    "module": record.module,
+                }
+            )
+            info = "," + fields[1:-1]  # 前後の波括弧を除いて連結用の断片にする
+            self._callsites[key] = info
+        return info
 
     def format(self, record):
         """レコードをJSON形式にフォーマット（日本時間対応）"""
-        log_record = {}
-
-        # 日本時間のタイムスタンプを生成
-        current_time = datetime.now(self.jst)
-        log_record["timestamp"] = current_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-        log_record["level"] = record.levelname
-        log_record["logger"] = record.name
-        log_record["message"] = record.getMessage()
-        log_record["hostname"] = self.hostname
-
-        # ファイル情報を常に追加
-        log_record["filename"] = record.filename
-        log_record["pathname"] = record.pathname
-        log_record["function"] = record.funcName
-        log_record["line"] = record.lineno
-        log_record["module"] = record.module
+        # ログ発生時刻から日本時間のタイムスタンプを生成
+        timestamp = _format_timestamp(record.created)
+
+        # JSONに変換（可変なフィールドのみをシリアライズし、不変な断片と連結）
+        # default=str により任意のオブジェクトは文字列化されるため、変換は失敗しない
+        parts = [
+            '{"timestamp":"',
+            timestamp,
+            '"',
+            self._header_json(record),
+            _dumps(record.getMessage()),
+            self._hostname_json,
+            self._callsite_json(record),  # ファイル情報を常に追加
+        ]
 
         # スタックトレース情報の追加（エラー時）
         if record.exc_info:
-            log_record["exception"] = {
+            exception = {
                 "type": record.exc_info[0].__name__,
                 "message": str(record.exc_info[1]),
                 "traceback": "".join(traceback.format_exception(*record.exc_info)),
             }
+            parts.append(',"exception":')
+            parts.append(_dumps(exception))
 
-        # 環境変数から追加情報を取得
-        for env_var in ["ENVIRONMENT", "SERVICE_NAME", "VERSION"]:
-            value = os.environ.get(f"zangetsu_{env_var}")
-            if value:
-                log_record[env_var.lower()] = value
+        # 環境変数から取得した追加情報
+        parts.append(self._env_json)
+        parts.append("}")
+        return "".join(parts)
 
-        # JSONに変換
-        try:
-            return json.dumps(log_record, default=str, ensure_ascii=False)
-        except Exception as e:
-            # JSONエンコードに失敗した場合のフォールバック
-            error_msg = f"JSON encoding error: {str(e)}"
-            print(error_msg)
-            return json.dumps(
-                {
-                    "timestamp": current_time.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
-                    "level": "ERROR",
-                    "message": record.getMessage(),
-                    "error": error_msg,
-                },
-                ensure_ascii=False,
-            )
+
+class zangetsuCachingJsonFormatter(zangetsuJsonFormatter):
+    """
+    フォーマット結果をレコードにキャッシュするJSONフォーマッタ
+
+    同じインスタンスを複数のハンドラで共有すると、1つのレコードに対する
+    JSON変換はハンドラの数によらず1回だけになります。
+    """
+
+    def format(self, record):
+        """キャッシュ済みであればそれを返し、なければフォーマットしてキャッシュ"""
+        cached = getattr(record, "_zangetsu_json", None)
+        if cached is not None and cached[0] is self:
+            return cached[1]
+        result = super().format(record)
+        record._zangetsu_json = (self, result)
+        return result
 
 
 class zangetsuConsoleFormatter(logging.Formatter):
@@ -75,12 +161,16 @@ class zangetsuConsoleFormatter(logging.Formatter):
             fmt = "%(jst_time)s - %(name)s - %(levelname)s - %(pathname)s:%(lineno)d - %(message)s"
         super().__init__(fmt, datefmt, style, validate)
         # 日本のタイムゾーンを設定
-        self.jst = pytz.timezone("Asia/Tokyo")
+        self.jst = JST
 
     def format(self, record):
         """レコードをフォーマット（日本時間対応）"""
-        # 日本時間のタイムスタンプを生成
-        jst_time = datetime.now(self.jst).strftime("%Y-%m-%d %H:%M:%S")
+        # ログ発生時刻から日本時間のタイムスタンプを生成
+        t = datetime.fromtimestamp(record.created, JST)
+        jst_time = (
+            f"{t.year:04d}-{t.month:02d}-{t.day:02d} "
+            f"{t.hour:02d}:{t.minute:02d}:{t.second:02d}"
+        )
 
         # レコードに日本時間を追加
         record.jst_time = jst_time
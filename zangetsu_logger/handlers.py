@@ -1,63 +1,522 @@
-import sys
+import copy
+import logging
+import operator
+import queue
 import os
+import re
+import threading
+import time
+import weakref
 from logging.handlers import RotatingFileHandler
 
+from zangetsu_logger.scheduler import flush_scheduler
+
+# ログファイルを開くフラグ（追記・exec時にクローズ・Windowsではバイナリモード）
+_OPEN_FLAGS = (
+    os.O_WRONLY
+    | os.O_CREAT
+    | getattr(os, "O_CLOEXEC", 0)
+    | getattr(os, "O_BINARY", 0)
+)
+
+# 書き込み待ちのログを溜めるバッファのサイズ（溢れる前にまとめて書き込む）
+_BUFFER_SIZE = 64 * 1024
+
+# 書き込みスレッドが一度にキューから取り出すレコードの最大数
+_BATCH_SIZE = 256
+
+# 完了を待たないフラッシュ要求（定期フラッシュ用）
+_FLUSH_REQUEST = object()
+
+# flush() が書き込みスレッドの完了を待つ最大秒数
+_FLUSH_TIMEOUT = 10.0
+
+# %スタイルの書式中のフィールド（"%%" はリテラルとして残す）
+_FIELD_PATTERN = re.compile(r"%%|%\((\w+)\)")
+
+# 絶対パスの判定（POSIX では先頭が区切り文字かどうかだけを見る）
+if os.sep == "/":
+
+    def _isabs(path):
+        return path.startswith("/")
+
+else:
+    _isabs = os.path.isabs
+
+# 生成済みのハンドラ（fork後の子プロセスで状態を作り直すため）
+_file_handlers = weakref.WeakSet()
+
+
+def _reset_writers_after_fork():
+    """fork後の子プロセスには書き込みスレッドが存在しないため、状態を初期化する"""
+    for handler in list(_file_handlers):
+        handler._queue = queue.SimpleQueue()
+        handler._writer_thread = None
+        # 親プロセスの別スレッドが保持していたロックは子プロセスでは解放されない
+        handler._writer_lock = threading.Lock()
+        handler._dropped = 0
+        # 書き込み待ちのログは親プロセスが書き込むため、子プロセスでは破棄する
+        handler._pending_size = 0
+
+
+def _write_all(fd, data):
+    """データをすべて書き込む（部分書き込みは続きから再送）"""
+    data = memoryview(data)
+    while data:
+        data = data[os.write(fd, data) :]
+
+
+def _compile_format(formatter):
+    """
+    単純な %スタイルの logging.Formatter を解析し、フォーマット関数を返す
+
+    書式のフィールドを位置指定の "%" に置き換えたテンプレートと、値をまとめて取り出す
+    attrgetter を組み合わせます（レコードの __dict__ を使った名前解決を避けるため）。
+    サブクラスや他のスタイルなど、同じ結果を保証できない場合は None を返します。
+    """
+    if type(formatter) is not logging.Formatter:
+        return None
+    style = formatter._style
+    if type(style) is not logging.PercentStyle or getattr(style, "_defaults", None):
+        return None
+
+    names = []
+
+    def _replace(match):
+        if match.group(1) is None:
+            return "%%"
+        names.append(match.group(1))
+        return "%"
+
+    template = _FIELD_PATTERN.sub(_replace, style._fmt)
+    # "*" による幅指定は引数の数が変わるため対象外
+    if not names or "*" in template:
+        return None
+
+    if len(names) == 1:
+        get_one = operator.attrgetter(names[0])
+
+        def get_fields(record):
+            return (get_one(record),)
+
+    else:
+        get_fields = operator.attrgetter(*names)
+
+    uses_time = "asctime" in names
+
+    def fast_format(record):
+        # Formatter.format と同様に message / asctime 属性を設定する
+        record.message = record.getMessage()
+        # datefmt は Formatter.format と同様に呼び出しごとに参照する
+        if uses_time:
+            record.asctime = formatter.formatTime(record, formatter.datefmt)
+        return template % get_fields(record)
+
+    return fast_format
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_writers_after_fork)
+
 
 class EnvVarFileHandler(RotatingFileHandler):
-    """環境変数でログファイルパスを設定できるRotatingFileHandler"""
+    """
+    環境変数でログファイルパスを設定できるRotatingFileHandler
+
+    emit() はレコードをキューに積むだけで戻り、フォーマットやファイルへの書き込みは
+    ハンドラごとのバックグラウンドスレッドがまとめて行います（初回のemit時に起動）。
+    フォーマット済みのログはメモリ上に溜め、ERROR以上のログ・一定量/一定時間の経過・
+    クローズ時にまとめて書き込みます（レコードごとのwriteシステムコールを避けるため）。
+    エンコーディングは既定でUTF-8です（ロケールには依存しません）。
+    書き込みが追いつかずキューに max_queue_size 件が溜まった場合、以降のレコードは
+    破棄して handleError() で報告します（例外のトレースバックなどを保持し続けないため）。
+    """
 
     def __init__(
-        self, filename, mode="a", maxBytes=0, backupCount=0, encoding=None, delay=False
+        self,
+        filename,
+        mode="a",
+        maxBytes=0,
+        backupCount=0,
+        encoding="utf-8",
+        delay=False,
+        flush_interval=30,
+        max_queue_size=100000,
     ):
         # ファイルパスを解決
         resolved_filename = self._resolve_filename(filename)
 
-        # 親ディレクトリを作成
-        os.makedirs(os.path.dirname(resolved_filename), exist_ok=True)
+        # 解析済みのフォーマッタ・スタイル・書式とフォーマット関数（format() の初回呼び出し時に作成）
+        self._compiled_formatter = None
+        self._compiled_style = None
+        self._compiled_fmt = None
+        self._fast_format = None
+
+        # 現在のファイルに書き込んだバイト数（ファイルを開いた時点のサイズから数える）
+        self._written = 0
+
+        # 書き込みスレッドが溜めているエンコード済みのログ
+        # （バッファは確保したまま使い回し、先頭 _pending_size バイトを有効とする）
+        self._pending = bytearray(_BUFFER_SIZE)
+        self._pending_size = 0
 
         super().__init__(
             resolved_filename, mode, maxBytes, backupCount, encoding, delay
         )
 
-        # ファイル作成確認とエラーハンドリング
-        try:
-            if not os.path.exists(resolved_filename) and not delay:
-                # 空のファイルを作成してみて、書き込み権限を確認
-                with open(resolved_filename, "w"):
-                    pass
-        except (IOError, PermissionError) as e:
-            # エラーをログに記録
-            sys.stderr.write(
-                f"Failed to create log file {resolved_filename}: {str(e)}\n"
-            )
-            # コンソールにリダイレクト
-            self.stream = sys.stderr
+        # ログはエンコード済みのバイト列として書き込むため、エンコーディングを確定しておく
+        # （encoding=None の場合、FileHandler は "locale" を設定する）
+        if self.encoding in (None, "locale"):
+            # 既定の UTF-8 では locale モジュールを読み込まない
+            import locale
+
+            self._encoding = locale.getencoding()
+        else:
+            self._encoding = self.encoding
+        self._errors = self.errors or "strict"
+
+        # バックグラウンドの書き込みスレッドへ渡すキュー
+        self._queue = queue.SimpleQueue()
+        self._writer_thread = None
+        self._writer_lock = threading.Lock()
+        _file_handlers.add(self)
+
+        # キューに積めるレコード数の上限と、上限到達後に破棄したレコード数
+        self.max_queue_size = max_queue_size
+        self._dropped = 0
+
+        # バッファに残ったログを定期的にフラッシュする
+        self.flush_interval = flush_interval
+        self._last_flush_time = time.monotonic()
+        if flush_interval > 0:
+            flush_scheduler.register(self)
 
     def _resolve_filename(self, filename):
         """環境変数や絶対/相対パスを考慮してファイル名を解決"""
-        # 環境変数 zangetsu_LOG_DIR が設定されていれば使用
-        log_dir = os.environ.get("zangetsu_LOG_DIR")
+        # pathlib.Path なども受け付ける
+        if type(filename) is not str:
+            filename = os.fspath(filename)
 
-        # 絶対パスの場合はそのまま使用
-        if os.path.isabs(filename):
+        # 絶対パスの場合はそのまま使用（環境変数も参照しない）
+        if _isabs(filename):
             return filename
 
-        # 環境変数が設定されている場合
-        if log_dir:
-            return os.path.join(log_dir, filename)
+        # 環境変数 zangetsu_LOG_DIR が設定されていれば使用し、なければ実行ディレクトリ
+        # initialize(log_dir=...) は実行時に環境変数を設定するため、値はキャッシュしない
+        log_dir = os.environ.get("zangetsu_LOG_DIR") or os.getcwd()
+        # filename は相対パスなので、os.path.join を使わず区切り文字で連結する
+        return f"{log_dir.rstrip(os.sep)}{os.sep}{filename}"
+
+    def _open(self):
+        """ログファイルを開く（親ディレクトリが無ければ作成）"""
+        try:
+            return self._open_file()
+        except FileNotFoundError:
+            # ディレクトリが存在する通常のケースでは mkdir のシステムコールを発行しない
+            os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+            return self._open_file()
+
+    def _open_file(self):
+        # テキスト/バッファ層は使わないため、os.open で開いた fd を生のファイルオブジェクトで包む
+        flags = _OPEN_FLAGS | (os.O_TRUNC if self.mode.startswith("w") else os.O_APPEND)
+        fd = os.open(self.baseFilename, flags, 0o666)
+        try:
+            # 以降のサイズは書き込み量から計算し、レコードごとの tell() を避ける
+            self._written = os.fstat(fd).st_size
+            return os.fdopen(fd, "wb", buffering=0)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    def _ensure_stream(self):
+        """ストリームが閉じていれば開き直す（delay=True やローテーション後）"""
+        if self.stream is None and (self.mode != "w" or not self._closed):
+            self.stream = self._open()
+        return self.stream
+
+    def _encoded_size(self, msg):
+        """書き込み後のバイト数を見積もる"""
+        if msg.isascii():
+            return len(msg)
+        return len(msg.encode(self._encoding, "replace"))
+
+    def _exceeds_max_bytes(self, size):
+        """size バイト書き込むとファイルが maxBytes に達するか"""
+        # 空のファイルはローテーションしない（1レコードが maxBytes を超える場合）
+        if not self._written or self._written + size < self.maxBytes:
+            return False
+        # bpo-45401: 通常ファイル以外はローテーションしない
+        return not os.path.exists(self.baseFilename) or os.path.isfile(
+            self.baseFilename
+        )
+
+    def shouldRollover(self, record):
+        """
+        ローテーションが必要かを判定
+
+        標準の実装はレコードごとに seek()/tell() を呼ぶため（bpo-46207）、
+        書き込み済みバイト数のカウンタで判定します。
+        """
+        if self.maxBytes <= 0 or self._ensure_stream() is None:
+            return False
+        msg = self.format(record) + self.terminator
+        return self._exceeds_max_bytes(self._encoded_size(msg))
+
+    def doRollover(self):
+        """ローテーションしてバイト数のカウンタを初期化"""
+        super().doRollover()
+        if self.stream is None:
+            self._written = 0
+
+    def format(self, record):
+        """
+        ログレコードをフォーマット
 
-        # デフォルトは実行ディレクトリ
-        return os.path.join(os.getcwd(), filename)
+        単純な %スタイルの Formatter は事前に解析した関数で処理し、
+        例外やスタック情報を含むレコードは通常の Formatter.format に任せます。
+        """
+        formatter = self.formatter or logging._defaultFormatter
+        fast_format = self._fast_format
+        # setFormatter() を経由せずに差し替えられた場合や、解析後に書式が変更された場合も
+        # 検出できるよう、ここで確認して解析し直す
+        if formatter is not self._compiled_formatter or (
+            fast_format is not None
+            and (
+                formatter._style is not self._compiled_style
+                or formatter._style._fmt is not self._compiled_fmt
+            )
+        ):
+            fast_format = self._compile(formatter)
+        if (
+            fast_format is None
+            or record.exc_info
+            or record.exc_text
+            or record.stack_info
+        ):
+            return formatter.format(record)
+        return fast_format(record)
+
+    def _compile(self, formatter):
+        """フォーマッタを解析し、変更の検出に使う書式と合わせて保持する"""
+        style = getattr(formatter, "_style", None)
+        self._fast_format = _compile_format(formatter)
+        self._compiled_formatter = formatter
+        self._compiled_style = style
+        self._compiled_fmt = getattr(style, "_fmt", None)
+        return self._fast_format
+
+    def handle(self, record):
+        """
+        フィルタを通過したレコードを書き込みスレッドのキューに積む
+
+        emit() はスレッドセーフなキューへの追加だけなので、ハンドラのロックは取りません。
+        """
+        rv = self.filter(record)
+        # Python 3.12 以降、フィルタは差し替えたレコードを返せる
+        if isinstance(rv, logging.LogRecord):
+            record = rv
+        if rv:
+            self.emit(record)
+        return rv
 
     def emit(self, record):
-        """ログレコードの出力処理をオーバーライドしてエラーハンドリングを強化"""
+        """
+        ログレコードを書き込みスレッドのキューに積む
+
+        フォーマットは書き込みスレッドで行うため、引数を埋め込んだメッセージはこの時点で
+        確定させます（積んだ後に引数のオブジェクトが変更されても、呼び出し時の値を残すため）。
+        レコードは QueueHandler.prepare() と同様にコピーし、後続のハンドラやフィルタには
+        元のレコードをそのまま渡します。
+        """
+        if self._queue.qsize() >= self.max_queue_size > 0:
+            self._drop(record)
+            return
+        if self._dropped:
+            self._dropped = 0
+
+        try:
+            # 書き込みスレッドがフォーマット時に設定する属性も、元のレコードには残さない
+            record = copy.copy(record)
+            # 文字列以外のメッセージ（dict など）も同様に文字列化しておく
+            if record.args or type(record.msg) is not str:
+                record.msg = record.getMessage()
+                record.args = None
+        except Exception:
+            self.handleError(record)
+            return
+        if self._writer_thread is None:
+            self._start_writer()
+        self._queue.put_nowait(record)
+
+    def _drop(self, record):
+        """キューが上限に達したためレコードを破棄する（破棄が続く間の報告は最初の1回のみ）"""
+        self._dropped += 1
+        if self._dropped > 1:
+            return
+        try:
+            raise OverflowError(
+                f"{self.baseFilename}: {self.max_queue_size} records are waiting "
+                "to be written; dropping records until the writer catches up"
+            )
+        except OverflowError:
+            self.handleError(record)
+
+    def _start_writer(self):
+        """書き込みスレッドを起動"""
+        with self._writer_lock:
+            if self._writer_thread is None:
+                thread = threading.Thread(
+                    target=self._drain, name="zangetsu-file-writer", daemon=True
+                )
+                thread.start()
+                self._writer_thread = thread
+
+    def _drain(self):
+        """キューからレコードをまとめて取り出してファイルに書き込む"""
+        q = self._queue
+        while True:
+            items = [q.get()]
+            while len(items) < _BATCH_SIZE:
+                try:
+                    items.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            for item in items:
+                if item is None:
+                    # クローズ要求（先に積まれたレコードは書き込み済み）
+                    stop = True
+                else:
+                    self._process(item)
+            if stop:
+                return
+
+    def _drain_remaining(self):
+        """キューに残った要素をこのスレッドで処理する（書き込みスレッドの停止後に呼ぶ）"""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                self._process(item)
+
+    def _process(self, item):
+        """キューから取り出した要素を処理する（例外で書き込みスレッドを止めない）"""
         try:
-            # 標準的なemit処理
-            super().emit(record)
-        except Exception as e:
-            # エラーを標準エラー出力に出力
-            sys.stderr.write(f"Error writing to log file: {str(e)}\n")
-            # スタックトレースを出力
-            import traceback
-
-            traceback.print_exc(file=sys.stderr)
+            if item is _FLUSH_REQUEST:
+                self._flush_stream()
+            elif isinstance(item, threading.Event):
+                # フラッシュ要求（失敗しても待っている呼び出し元は必ず起こす）
+                try:
+                    self._flush_stream()
+                finally:
+                    item.set()
+            else:
+                self._write_record(item)
+        except Exception:
+            # 書き込みに失敗しても後続のログの処理は続ける
+            self.handleError(None)
+
+    def _write_record(self, record):
+        """ログレコードをファイルに書き込む（書き込みスレッドから呼ばれる）"""
+        try:
+            if self._ensure_stream() is None:
+                return
+            data = (self.format(record) + self.terminator).encode(
+                self._encoding, self._errors
+            )
+
+            # フォーマット済みのメッセージでサイズを判定（shouldRollover での二重フォーマットを避ける）
+            if self.maxBytes > 0:
+                if self._exceeds_max_bytes(len(data)):
+                    # 溜めていたログはローテーション前のファイルに書き込む
+                    self._write_pending()
+                    self.doRollover()
+                    if self._ensure_stream() is None:
+                        return
+                self._written += len(data)
+
+            # レコードごとには書き込まず、ERROR以上の場合かバッファが溢れる場合に書き込む
+            self._append_pending(data)
+            if record.levelno >= logging.ERROR:
+                self._flush_stream()
+        except Exception:
+            # 標準のエラー処理に委ねる（logging.raiseExceptions が False なら何もしない）
+            self.handleError(record)
+
+    def _append_pending(self, data):
+        """エンコード済みのログをバッファに追加する"""
+        start = self._pending_size
+        end = start + len(data)
+        if end > _BUFFER_SIZE:
+            self._flush_stream()
+            if len(data) > _BUFFER_SIZE:
+                # バッファより大きいログは直接書き込む
+                if self.stream:
+                    _write_all(self.stream.fileno(), data)
+                return
+            start, end = 0, len(data)
+        # 同じ長さのスライス代入なので、バッファの再確保は起きない
+        self._pending[start:end] = data
+        self._pending_size = end
+
+    def _write_pending(self):
+        """溜めていたログを1回の write でファイルに書き込む"""
+        size = self._pending_size
+        if not size:
+            return
+        # 書き込みに失敗しても同じログを再送し続けないよう、先に空にする
+        self._pending_size = 0
+        if self.stream:
+            _write_all(self.stream.fileno(), memoryview(self._pending)[:size])
+
+    def _flush_stream(self):
+        """溜めていたログをファイルに書き出す"""
+        # ストリームは書き込みスレッドだけが扱うため、ハンドラのロックは取らない
+        # （ロックを保持したまま flush() を呼ぶ logging.shutdown() と競合させない）
+        self._write_pending()
+        self._last_flush_time = time.monotonic()
+
+    def flush(self):
+        """キューに積まれたログを書き込んでからディスクに書き出す"""
+        if self._writer_thread is threading.current_thread():
+            self._flush_stream()
+            return
+
+        # close() がクローズ要求を積んでから書き込みスレッドを止めるまでの間に
+        # フラッシュ要求を積まないよう、ロックを取って確認する
+        with self._writer_lock:
+            thread = self._writer_thread
+            if thread is None or not thread.is_alive():
+                self._flush_stream()
+                return
+            # 書き込みスレッドに先行レコードの書き込みとフラッシュを依頼する
+            done = threading.Event()
+            self._queue.put_nowait(done)
+
+        # 書き込みが止まっていても呼び出し元が終了できるよう、待つ時間には上限を設ける
+        done.wait(_FLUSH_TIMEOUT)
+
+    def _periodic_flush(self):
+        """定期フラッシュ（書き込みスレッドにフラッシュを依頼し、完了は待たない）"""
+        # 溜めているログは書き込みスレッドだけが持つため、起動前なら何もしない
+        if self._writer_thread is not None:
+            self._queue.put_nowait(_FLUSH_REQUEST)
+
+    def close(self):
+        """定期フラッシュを停止し、キューを書き切ってからクローズ"""
+        flush_scheduler.unregister(self)
+
+        with self._writer_lock:
+            thread = self._writer_thread
+            if thread is not None and thread is not threading.current_thread():
+                self._queue.put_nowait(None)
+                thread.join()
+                self._writer_thread = None
+                # クローズ要求の後に積まれたレコードやフラッシュ要求を処理する
+                self._drain_remaining()
+
+        # 残りのログはクローズ時の flush() で書き出される
+        super().close()
@@ -0,0 +1,118 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import weakref
+
+
+class FlushScheduler:
+    """
+    全ハンドラの定期フラッシュを1本のデーモンスレッドでまとめて行うスケジューラ
+
+    ハンドラごとにスレッドを立てる代わりに、次回フラッシュ時刻のヒープを管理します。
+    ハンドラは弱参照で保持するため、スケジューラがハンドラの寿命を延ばすことはありません。
+    対象のハンドラは flush_interval（秒）と _last_flush_time（time.monotonic() の値）を
+    属性として持ち、フラッシュ時に _last_flush_time を更新する必要があります。
+    定期フラッシュでは _periodic_flush() を呼び出します。1本のスレッドを全ハンドラで
+    共有するため、_periodic_flush() はフラッシュの完了を待たずに戻る必要があります。
+    時刻の計算にはシステム時刻の変更に影響されない time.monotonic() を使います。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []  # (次回フラッシュ時刻, 登録順, ハンドラへの弱参照)
+        self._handlers = weakref.WeakSet()
+        self._counter = itertools.count()
+        self._thread = None
+
+    def register(self, handler: logging.Handler) -> None:
+        """ハンドラを定期フラッシュの対象に追加"""
+        with self._cond:
+            self._handlers.add(handler)
+            self._push(handler, time.monotonic() + handler.flush_interval)
+            if self._thread is None:
+                self._start()
+            self._cond.notify()
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="zangetsu-flush-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    def _reset_after_fork(self) -> None:
+        """fork後の子プロセスにはスケジューラのスレッドが存在しないため、作り直す"""
+        # 親プロセスの別スレッドが保持していたロックは子プロセスでは解放されない
+        self._cond = threading.Condition()
+        self._thread = None
+        self._heap = []
+        now = time.monotonic()
+        for handler in list(self._handlers):
+            self._push(handler, now + handler.flush_interval)
+        if self._heap:
+            self._start()
+
+    def unregister(self, handler: logging.Handler) -> None:
+        """ハンドラを定期フラッシュの対象から外す"""
+        # ヒープ上のエントリは取り出し時に破棄するため、待機中のスレッドを起こす
+        with self._cond:
+            self._handlers.discard(handler)
+            self._cond.notify()
+
+    def _push(self, handler: logging.Handler, deadline: float) -> None:
+        heapq.heappush(
+            self._heap, (deadline, next(self._counter), weakref.ref(handler))
+        )
+
+    def _next_due(self) -> logging.Handler:
+        """次にフラッシュ時刻を迎えるハンドラを待って返す"""
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, ref = self._heap[0]
+                handler = ref()
+                if handler is None or handler not in self._handlers:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = deadline - time.monotonic()
+                if delay <= 0:
+                    heapq.heappop(self._heap)
+                    return handler
+                handler = None
+                self._cond.wait(delay)
+
+    def _run(self) -> None:
+        while True:
+            handler = self._next_due()
+
+            # フラッシュ中も他ハンドラの登録を妨げないようロックの外でフラッシュ
+            try:
+                if (
+                    time.monotonic() - handler._last_flush_time
+                    >= handler.flush_interval
+                ):
+                    handler._periodic_flush()
+            except Exception:
+                # 他のハンドラの定期フラッシュは続ける
+                handler.handleError(None)
+
+            # 直近のフラッシュ（容量到達などによるものを含む）から次回時刻を決める
+            with self._cond:
+                if handler in self._handlers:
+                    now = time.monotonic()
+                    deadline = handler._last_flush_time + handler.flush_interval
+                    if deadline <= now:
+                        # フラッシュに失敗した場合などは現在時刻から数え直す
+                        deadline = now + handler.flush_interval
+                    self._push(handler, deadline)
+            handler = None
+
+
+flush_scheduler = FlushScheduler()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=flush_scheduler._reset_after_fork)